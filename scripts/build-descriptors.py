@@ -0,0 +1,110 @@
+import collections
+import pathlib
+
+import click
+import tqdm
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+def get_descriptors(smiles: str) -> dict:
+    """
+    Compute cheap descriptors of a molecule for prefiltering SMARTS searches.
+
+    The molecule is prepared with the same steps as ``load_rdkit_molecule``
+    in get-smiles-matches.py, so aromaticity follows the MDL model.
+    Returns None if the SMILES cannot be loaded.
+    """
+    from rdkit import Chem
+    from rdkit.Chem import rdMolDescriptors
+
+    partial_sanitization = (
+        Chem.SanitizeFlags.SANITIZE_ALL
+        ^ Chem.SanitizeFlags.SANITIZE_ADJUSTHS
+        ^ Chem.SanitizeFlags.SANITIZE_SETAROMATICITY
+    )
+    rdmol = Chem.MolFromSmiles(smiles, sanitize=False)
+    if rdmol is None:
+        return None
+    try:
+        Chem.SanitizeMol(rdmol, partial_sanitization)
+    except Exception:
+        return None
+    Chem.SetAromaticity(rdmol, Chem.AromaticityModel.AROMATICITY_MDL)
+    Chem.AssignStereochemistry(rdmol)
+    rdmol = Chem.AddHs(rdmol)
+    Chem.Kekulize(rdmol, clearAromaticFlags=True)
+    Chem.SanitizeMol(rdmol, partial_sanitization)
+    Chem.SetAromaticity(rdmol, Chem.AromaticityModel.AROMATICITY_MDL)
+
+    atoms = list(rdmol.GetAtoms())
+    element_counts = collections.Counter(atom.GetSymbol() for atom in atoms)
+    charges = [atom.GetFormalCharge() for atom in atoms]
+    descriptors = {
+        "smiles": smiles,
+        "n_heavy_atoms": rdmol.GetNumHeavyAtoms(),
+        "n_rings": rdMolDescriptors.CalcNumRings(rdmol),
+        # not aromatic rings: MDL aromatic atoms need not form an aromatic SSSR ring
+        "n_aromatic_atoms": sum(atom.GetIsAromatic() for atom in atoms),
+        "has_positive_charge": any(charge > 0 for charge in charges),
+        "has_negative_charge": any(charge < 0 for charge in charges),
+    }
+    for symbol, count in element_counts.items():
+        descriptors[f"n_{symbol}"] = count
+    return descriptors
+
+
+@click.command()
+@click.option(
+    "--dataset-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="tables",
+)
+@click.option(
+    "--output-file",
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    default="descriptors/molecules.parquet",
+)
+def main(
+    dataset_directory: str = "tables",
+    output_file: str = "descriptors/molecules.parquet",
+):
+    smiles_column = ds.dataset(dataset_directory).to_table(columns=["smiles"])["smiles"]
+    unique_smiles = sorted(pc.unique(smiles_column).to_pylist())
+
+    rows = []
+    for smiles in tqdm.tqdm(unique_smiles, desc="Computing descriptors"):
+        descriptors = get_descriptors(smiles)
+        if descriptors is None:
+            print(f"Skipping unparseable SMILES {smiles}")
+            continue
+        rows.append(descriptors)
+
+    # every element seen gets a column, with 0 for molecules without it
+    element_columns = sorted({
+        key
+        for row in rows
+        for key in row
+        if key.startswith("n_") and key[2:3].isupper()
+    })
+    columns = ["smiles", "n_heavy_atoms", "n_rings", "n_aromatic_atoms"]
+    flags = ["has_positive_charge", "has_negative_charge"]
+    table = pa.table({
+        **{column: [row[column] for row in rows] for column in columns + flags},
+        **{
+            column: pa.array([row.get(column, 0) for row in rows], type=pa.int16())
+            for column in element_columns
+        },
+    })
+
+    output_file = pathlib.Path(output_file)
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    pq.write_table(table, output_file)
+    print(f"Saved descriptors of {len(table)} molecules to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import pathlib
+
+import click
+import tqdm
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+
+def morgan_fingerprint(smiles: str, radius: int = 2, n_bits: int = 2048) -> np.ndarray:
+    """
+    Compute a Morgan fingerprint packed into bytes.
+
+    Returns None if the SMILES cannot be parsed.
+    """
+    from rdkit import Chem
+    from rdkit.Chem import rdFingerprintGenerator
+
+    rdmol = Chem.MolFromSmiles(smiles)
+    if rdmol is None:
+        return None
+    generator = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=n_bits)
+    return np.packbits(generator.GetFingerprintAsNumPy(rdmol))
+
+
+@click.command()
+@click.option(
+    "--dataset-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="tables",
+)
+@click.option(
+    "--output-file",
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    default="fingerprints/morgan.parquet",
+)
+@click.option(
+    "--radius",
+    type=int,
+    default=2,
+)
+@click.option(
+    "--n-bits",
+    type=int,
+    default=2048,
+    help="Fingerprint length. Must be a multiple of 64.",
+)
+def main(
+    dataset_directory: str = "tables",
+    output_file: str = "fingerprints/morgan.parquet",
+    radius: int = 2,
+    n_bits: int = 2048,
+):
+    if n_bits % 64:
+        raise ValueError(f"n_bits must be a multiple of 64, not {n_bits}")
+
+    smiles_column = ds.dataset(dataset_directory).to_table(columns=["smiles"])["smiles"]
+    unique_smiles = sorted(pc.unique(smiles_column).to_pylist())
+
+    all_smiles = []
+    fingerprints = []
+    for smiles in tqdm.tqdm(unique_smiles, desc="Computing fingerprints"):
+        fingerprint = morgan_fingerprint(smiles, radius=radius, n_bits=n_bits)
+        if fingerprint is None:
+            print(f"Skipping unparseable SMILES {smiles}")
+            continue
+        all_smiles.append(smiles)
+        fingerprints.append(fingerprint)
+
+    matrix = np.vstack(fingerprints)
+    bit_counts = np.unpackbits(matrix, axis=1).sum(axis=1, dtype=np.int32)
+    n_bytes = n_bits // 8
+    fingerprint_array = pa.FixedSizeBinaryArray.from_buffers(
+        pa.binary(n_bytes),
+        len(matrix),
+        [None, pa.py_buffer(matrix.tobytes())],
+    )
+    table = pa.table(
+        {
+            "smiles": all_smiles,
+            "fingerprint": fingerprint_array,
+            "bit_count": bit_counts,
+        }
+    )
+    table = table.replace_schema_metadata(
+        {
+            "fingerprint": "morgan",
+            "radius": str(radius),
+            "n_bits": str(n_bits),
+        }
+    )
+
+    output_file = pathlib.Path(output_file)
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+    pq.write_table(table, output_file)
+    print(f"Saved {len(table)} fingerprints to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
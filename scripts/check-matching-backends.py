@@ -0,0 +1,123 @@
+"""
+Check that every matching backend in get-smiles-matches.py
+returns the same matches as the OpenFF toolkit on the corpus in tables/.
+"""
+
+import importlib.util
+import pathlib
+
+import click
+import tqdm
+
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+
+DEFAULT_PATTERNS = [
+    "[#6:1]",
+    "[#1:1]-[#8:2]",
+    "[#15:1]-[#16:2]",
+    "[a:1]",
+    "[#6:1]:[#7:2]",
+    "[#7X3:1]",
+    "[#6X4:1]-[#1:2]",
+    "[#6:1]=[#8:2]",
+    "[r5:1]",
+    "[#7+1:1]",
+    "[#8-1:1]",
+    "[*:1]~[*:2]:[*:3]~[*:4]",
+    # stereo
+    "[#6:1]-[C@H:2](-[#7:3])-[#8:4]",
+    "[#6:1]-[C@@H:2](-[#7:3])-[#8:4]",
+    "[#6X4@:1]",
+    "[#6:1]/[#6:2]=[#6:3]/[#6:4]",
+    "[#6:1]/[#6:2]=[#6:3]\\[#6:4]",
+]
+
+
+def load_search_script():
+    # the script name is not a valid module name, so load it by path
+    path = pathlib.Path(__file__).parent / "get-smiles-matches.py"
+    spec = importlib.util.spec_from_file_location("get_smiles_matches", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# the result for a molecule a backend cannot load.
+# Error messages differ between backends, so they are not compared.
+LOAD_FAILED = "failed to load"
+
+
+def get_matches(load_molecule, match_function, smiles: str, patterns: list[str]):
+    try:
+        molecule = load_molecule(smiles)
+    except Exception:
+        return LOAD_FAILED
+    return tuple(match_function(molecule, pattern) for pattern in patterns)
+
+
+@click.command()
+@click.option(
+    "--pattern",
+    "patterns",
+    type=str,
+    multiple=True,
+    default=DEFAULT_PATTERNS,
+    help="SMARTS to compare. Defaults to a set covering aromaticity, hydrogens and charges.",
+)
+@click.option(
+    "--dataset-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="tables",
+)
+@click.option(
+    "--max-molecules",
+    type=int,
+    default=None,
+    help="Only check this many unique SMILES.",
+)
+def main(
+    patterns: list[str],
+    dataset_directory: str = "tables",
+    max_molecules: int = None,
+):
+    search = load_search_script()
+    reference = search.BACKENDS["openff"]
+    others = {
+        name: functions
+        for name, functions in search.BACKENDS.items()
+        if name != "openff"
+    }
+
+    smiles_column = ds.dataset(dataset_directory).to_table(columns=["smiles"])["smiles"]
+    unique_smiles = sorted(pc.unique(smiles_column).to_pylist())
+    if max_molecules is not None:
+        unique_smiles = unique_smiles[:max_molecules]
+
+    mismatches = []
+    n_failed = 0
+    for smiles in tqdm.tqdm(unique_smiles, desc="Comparing backends"):
+        expected = get_matches(*reference, smiles, patterns)
+        n_failed += expected == LOAD_FAILED
+        for name, functions in others.items():
+            result = get_matches(*functions, smiles, patterns)
+            if result != expected:
+                mismatches.append((name, smiles, expected, result))
+
+    for name, smiles, expected, result in mismatches:
+        print(f"{name}: {smiles}")
+        print(f"    openff: {expected}")
+        print(f"    {name}: {result}")
+
+    print(
+        f"Compared {len(unique_smiles)} molecules and {len(patterns)} patterns "
+        f"against backends {sorted(others)}: {len(mismatches)} mismatches"
+    )
+    print(f"{n_failed} molecules could not be loaded by openff")
+    if mismatches:
+        raise ValueError(f"{len(mismatches)} molecules differ between backends")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Checkpoints for resuming long runs of the scripts in this directory.
+
+A checkpoint is a small JSON file recording progress.
+Results so far are kept next to it in one parquet file per chunk,
+so each checkpoint only writes what is new since the last one.
+"""
+
+import json
+import os
+import pathlib
+import typing
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+def save_checkpoint(checkpoint_file: pathlib.Path, checkpoint: dict):
+    """
+    Write a checkpoint to a temporary file and move it into place,
+    so an interrupted write never leaves a corrupt checkpoint.
+    """
+    temporary_file = checkpoint_file.with_suffix(".tmp")
+    temporary_file.write_text(json.dumps(checkpoint))
+    os.replace(temporary_file, checkpoint_file)
+
+
+def load_checkpoint(checkpoint_file: pathlib.Path, key: str) -> dict:
+    """
+    Load a checkpoint written by ``save_checkpoint``.
+
+    Returns an empty checkpoint if there is none.
+
+    Raises
+    ------
+    ValueError
+        If the checkpoint was written for a different ``key``.
+    """
+    if not checkpoint_file.exists():
+        print(f"No checkpoint found at {checkpoint_file}, starting from scratch")
+        return {}
+    checkpoint = json.loads(checkpoint_file.read_text())
+    if checkpoint["key"] != key:
+        raise ValueError(
+            f"Checkpoint {checkpoint_file} is for {checkpoint['key']!r}, not {key!r}"
+        )
+    return checkpoint
+
+
+def _get_chunk_prefix(checkpoint_file: pathlib.Path) -> str:
+    # e.g. ".dataset.checkpoint." for ".dataset.checkpoint.json"
+    return checkpoint_file.name[:-len(checkpoint_file.suffix)] + "."
+
+
+def get_chunk_files(checkpoint_file: pathlib.Path) -> dict[int, pathlib.Path]:
+    """
+    Find the chunks saved with ``save_chunk``, by the position they start at.
+    """
+    prefix = _get_chunk_prefix(checkpoint_file)
+    return {
+        int(file.name[len(prefix):-len(".parquet")]): file
+        for file in checkpoint_file.parent.glob("*.parquet")
+        if file.name.startswith(prefix)
+    }
+
+
+def save_chunk(
+    checkpoint_file: pathlib.Path,
+    start: int,
+    table: pa.Table,
+) -> pathlib.Path:
+    """
+    Save the results of the chunk starting at position ``start``
+    next to ``checkpoint_file``.
+
+    Chunk files are named after the checkpoint file,
+    so a dot-prefixed checkpoint gives dot-prefixed chunks
+    that ``pyarrow.dataset`` skips.
+    """
+    chunk_file = checkpoint_file.parent / f"{_get_chunk_prefix(checkpoint_file)}{start}.parquet"
+    pq.write_table(table, chunk_file)
+    return chunk_file
+
+
+def load_chunks(checkpoint_file: pathlib.Path) -> typing.Optional[pa.Table]:
+    """
+    Concatenate the saved chunks in order.
+    Returns None if there are none.
+    """
+    chunk_files = get_chunk_files(checkpoint_file)
+    if not chunk_files:
+        return None
+    return pa.concat_tables(
+        [pq.read_table(chunk_files[start]) for start in sorted(chunk_files)],
+        promote_options="permissive",
+    )
+
+
+def remove_chunks(checkpoint_file: pathlib.Path, start: int = 0):
+    """
+    Remove the saved chunks starting at or after ``start``,
+    e.g. chunks past the checkpoint left by an interrupted run.
+    """
+    for chunk_start, chunk_file in get_chunk_files(checkpoint_file).items():
+        if chunk_start >= start:
+            chunk_file.unlink()
@@ -1,8 +1,14 @@
 import base64
+import collections
+import functools
+import operator
 import os
 import pathlib
 import requests
 import textwrap
+import time
+import typing
+import zlib
 
 import click
 import tqdm
@@ -11,18 +17,631 @@ from github import Github
 from github import InputGitTreeElement
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pcsv
 import pyarrow.dataset as ds
 import pyarrow.compute as pc
+import pyarrow.parquet as pq
 from openff.toolkit import Molecule
 
+import checkpoints
+
 
 import click
 import pathlib
 
 REPO_NAME = "lilyminium/qca-datasets-report"
 
+MATCH_COLUMNS = [
+    "type", "dataset", "specification", "smiles", "qcarchive_id", "torsiondrive_id"
+]
+COUNT_KEYS = ["type", "dataset", "specification"]
+
+def load_openff_molecule(smiles: str) -> Molecule:
+    return Molecule.from_smiles(smiles, allow_undefined_stereo=True)
+
+
+def match_openff(molecule: Molecule, pattern: str) -> bool:
+    return bool(molecule.chemical_environment_matches(pattern))
+
+
+def load_rdkit_molecule(smiles: str):
+    """
+    Load a SMILES into an RDKit molecule prepared the same way
+    the OpenFF toolkit prepares one for SMARTS matching:
+    partial sanitization, explicit hydrogens and the MDL aromaticity model.
+
+    Like ``Molecule.from_smiles``, this raises for SMILES
+    that RDKit cannot sanitize, e.g. hypervalent nitrogens.
+    """
+    from rdkit import Chem
+
+    # mirror the OpenFF RDKit wrapper rather than fully sanitizing
+    partial_sanitization = (
+        Chem.SanitizeFlags.SANITIZE_ALL
+        ^ Chem.SanitizeFlags.SANITIZE_ADJUSTHS
+        ^ Chem.SanitizeFlags.SANITIZE_SETAROMATICITY
+    )
+    rdmol = Chem.MolFromSmiles(smiles, sanitize=False)
+    if rdmol is None:
+        raise ValueError(f"Could not parse SMILES {smiles}")
+    Chem.SanitizeMol(rdmol, partial_sanitization)
+    Chem.SetAromaticity(rdmol, Chem.AromaticityModel.AROMATICITY_MDL)
+    # sets double bond stereo from the bond directions in the SMILES
+    Chem.AssignStereochemistry(rdmol)
+    rdmol = Chem.AddHs(rdmol)
+
+    # OpenFF matches against a kekulized copy, re-perceiving aromaticity
+    Chem.Kekulize(rdmol, clearAromaticFlags=True)
+    Chem.SanitizeMol(rdmol, partial_sanitization)
+    Chem.SetAromaticity(rdmol, Chem.AromaticityModel.AROMATICITY_MDL)
+    return rdmol
+
+
+@functools.lru_cache(maxsize=None)
+def compile_smarts(pattern: str):
+    """Parse a SMARTS pattern into an RDKit query molecule, once."""
+    from rdkit import Chem
+
+    query = Chem.MolFromSmarts(pattern)
+    if query is None:
+        raise ValueError(f"Could not parse SMARTS {pattern}")
+    return query
+
+
+def match_rdkit(rdmol, pattern: str) -> bool:
+    # OpenFF matches stereo in the SMARTS, e.g. @ and /
+    return rdmol.HasSubstructMatch(compile_smarts(pattern), useChirality=True)
+
+
+# name: (function loading a SMILES, function matching a loaded molecule to a SMARTS)
+BACKENDS = {
+    "openff": (load_openff_molecule, match_openff),
+    "rdkit": (load_rdkit_molecule, match_rdkit),
+}
+
+
+class Clause:
+    """
+    A single SMARTS clause of a search query,
+    with running statistics of how often it hits and how long it takes.
+    """
+
+    def __init__(self, kind: typing.Literal["pattern", "exclude", "any"], pattern: str):
+        self.kind = kind
+        self.pattern = pattern
+        self.n_evaluated = 0
+        self.n_hits = 0
+        self.time = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        # Laplace smoothing so unseen clauses start at 0.5
+        return (self.n_hits + 1) / (self.n_evaluated + 2)
+
+    @property
+    def mean_time(self) -> float:
+        return (self.time + 1e-6) / (self.n_evaluated + 1)
+
+    @property
+    def rejection_rate(self) -> float:
+        """The estimated fraction of molecules this clause rejects on its own."""
+        if self.kind == "pattern":
+            return 1 - self.hit_rate
+        if self.kind == "exclude":
+            return self.hit_rate
+        return 0.0
+
+    def __repr__(self):
+        return (
+            f"--{self.kind} '{self.pattern}': "
+            f"{self.n_hits}/{self.n_evaluated} hits, "
+            f"{self.mean_time * 1e3:.3f} ms/molecule"
+        )
+
+
+class QueryPlanner:
+    """
+    Evaluate a boolean query of SMARTS clauses against molecules in one pass.
+
+    A molecule matches if it matches every ``--pattern``, none of the
+    ``--exclude`` patterns, and at least one ``--any`` pattern (if given).
+    A query of only ``--exclude`` clauses removes molecules from
+    a base set chosen elsewhere, e.g. by ``--similar``.
+    Evaluation short-circuits on the first deciding clause.
+    Clauses that can reject a molecule are tried first, in order of
+    rejection rate per unit time; ``--any`` clauses are tried last,
+    in order of hit rate per unit time. Both orders are recomputed from
+    running statistics every ``reorder_every`` molecules.
+
+    Parameters
+    ----------
+    patterns : list[str]
+        SMARTS that must all match.
+    excludes : list[str], optional
+        SMARTS that must not match.
+    any_patterns : list[str], optional
+        SMARTS of which at least one must match.
+    match_function : callable, optional
+        Called as ``match_function(molecule, pattern)`` and returns
+        whether the pattern matches. By default uses
+        ``Molecule.chemical_environment_matches``.
+        See ``BACKENDS``.
+    reorder_every : int, optional
+        How many molecules to evaluate between reorderings, by default 256
+    """
+
+    def __init__(
+        self,
+        patterns: list[str],
+        excludes: list[str] = (),
+        any_patterns: list[str] = (),
+        match_function: typing.Callable[[typing.Any, str], bool] = None,
+        reorder_every: int = 256,
+    ):
+        if not patterns and not excludes and not any_patterns:
+            raise ValueError("At least one --pattern, --exclude or --any must be given")
+        if match_function is None:
+            match_function = match_openff
+        self.match_function = match_function
+        self.reorder_every = reorder_every
+        self.n_evaluated = 0
+
+        self.rejecting_clauses = (
+            [Clause("pattern", pattern) for pattern in patterns]
+            + [Clause("exclude", pattern) for pattern in excludes]
+        )
+        self.any_clauses = [Clause("any", pattern) for pattern in any_patterns]
+        # kept in the order given, for reporting
+        self.clauses = self.rejecting_clauses + self.any_clauses
+
+    def to_command(self) -> str:
+        """The botsearch arguments reproducing this query."""
+        return "".join(
+            f" --{clause.kind} '{clause.pattern}'"
+            for clause in self.clauses
+        )
+
+    def reorder(self):
+        self.rejecting_clauses.sort(
+            key=lambda clause: clause.rejection_rate / clause.mean_time,
+            reverse=True,
+        )
+        self.any_clauses.sort(
+            key=lambda clause: clause.hit_rate / clause.mean_time,
+            reverse=True,
+        )
+
+    def _check(self, clause: Clause, molecule) -> bool:
+        start = time.perf_counter()
+        hit = self.match_function(molecule, clause.pattern)
+        clause.time += time.perf_counter() - start
+        clause.n_evaluated += 1
+        clause.n_hits += hit
+        return hit
+
+    def evaluate(self, molecule) -> bool:
+        """Return whether ``molecule`` satisfies the query."""
+        self.n_evaluated += 1
+        if self.n_evaluated % self.reorder_every == 0:
+            self.reorder()
+
+        for clause in self.rejecting_clauses:
+            hit = self._check(clause, molecule)
+            if hit == (clause.kind == "exclude"):
+                return False
+
+        if not self.any_clauses:
+            return True
+        for clause in self.any_clauses:
+            if self._check(clause, molecule):
+                return True
+        return False
+
+
+def _parse_query_description(description: str) -> tuple[str, list]:
+    """
+    Parse the indented tree from RDKit's ``DescribeQuery``
+    into nested (line, children) tuples.
+    """
+    root = ("root", [])
+    stack = [(-1, root)]
+    for line in description.splitlines():
+        if not line.strip():
+            continue
+        depth = len(line) - len(line.lstrip())
+        node = (line.strip(), [])
+        while stack[-1][0] >= depth:
+            stack.pop()
+        stack[-1][1][1].append(node)
+        stack.append((depth, node))
+    return root[1][0]
+
+
+def _get_query_facts(node: tuple[str, list]) -> dict:
+    """
+    Find what a query atom or bond definitely requires of the molecule.
+
+    Returns a dict that may have an "element" (atomic number),
+    "charge" (+1 or -1 for the sign), "aromatic" and "in_ring".
+    Anything the query does not definitely require is left out,
+    so unknown query types simply give no facts.
+    """
+    line, children = node
+    tokens = line.split()
+    name = tokens[0]
+
+    if name in ("AtomAnd", "BondAnd"):
+        facts = {}
+        for child in children:
+            facts.update(_get_query_facts(child))
+        return facts
+    if name in ("AtomOr", "BondOr"):
+        # only facts every alternative agrees on
+        child_facts = [_get_query_facts(child) for child in children]
+        return {
+            key: value
+            for key, value in child_facts[0].items()
+            if all(facts.get(key) == value for facts in child_facts[1:])
+        }
+    if len(tokens) != 4 or tokens[2] != "=":
+        # negations, recursive SMARTS, wildcards
+        return {}
+
+    value = int(tokens[1])
+    if name == "AtomAtomicNum":
+        return {"element": value}
+    if name == "AtomType":
+        # aromatic atom types are offset by 1000
+        if value >= 1000:
+            return {"element": value - 1000, "aromatic": True, "in_ring": True}
+        return {"element": value}
+    if name == "AtomIsAromatic" and value:
+        return {"aromatic": True, "in_ring": True}
+    if name in ("AtomMinRingSize", "AtomRingBondCount", "AtomInNRings") and value:
+        # "R" is AtomInNRings -1
+        return {"in_ring": True}
+    if name == "AtomFormalCharge" and value:
+        return {"charge": 1 if value > 0 else -1}
+    if name == "BondInRing" and value:
+        return {"in_ring": True}
+    return {}
+
+
+@functools.lru_cache(maxsize=None)
+def derive_conditions(pattern: str) -> dict[str, int]:
+    """
+    Derive conditions that any molecule matching a SMARTS must meet,
+    as minimum values of columns written by ``build-descriptors.py``.
+
+    Each query atom matches a different atom of the molecule,
+    so the number of query atoms requiring an element
+    is a lower bound on the count of that element.
+    Patterns RDKit cannot parse give no conditions.
+
+    Returns
+    -------
+    dict[str, int]
+        Column names and their minimum values.
+    """
+    from rdkit import Chem
+
+    query = Chem.MolFromSmarts(pattern)
+    if query is None:
+        return {}
+
+    atom_facts = [
+        _get_query_facts(_parse_query_description(atom.DescribeQuery()))
+        for atom in query.GetAtoms()
+    ]
+    bond_facts = [
+        _get_query_facts(_parse_query_description(bond.DescribeQuery()))
+        for bond in query.GetBonds()
+    ]
+
+    periodic_table = Chem.GetPeriodicTable()
+    element_counts = collections.Counter(
+        periodic_table.GetElementSymbol(facts["element"])
+        for facts in atom_facts
+        if facts.get("element")
+    )
+    conditions = {
+        f"n_{symbol}": count
+        for symbol, count in element_counts.items()
+    }
+    n_heavy_atoms = sum(
+        count for symbol, count in element_counts.items() if symbol != "H"
+    )
+    if n_heavy_atoms:
+        conditions["n_heavy_atoms"] = n_heavy_atoms
+    if any(facts.get("in_ring") for facts in atom_facts + bond_facts):
+        conditions["n_rings"] = 1
+    n_aromatic_atoms = sum(bool(facts.get("aromatic")) for facts in atom_facts)
+    if n_aromatic_atoms:
+        conditions["n_aromatic_atoms"] = n_aromatic_atoms
+    charges = {facts.get("charge") for facts in atom_facts}
+    if 1 in charges:
+        conditions["has_positive_charge"] = 1
+    if -1 in charges:
+        conditions["has_negative_charge"] = 1
+    return conditions
+
+
+def conditions_to_expression(
+    conditions: dict[str, int],
+    schema: pa.Schema,
+) -> pc.Expression:
+    """
+    Turn conditions from ``derive_conditions`` into an Arrow predicate.
+    Conditions on elements without a column cannot be met by any molecule.
+    """
+    expressions = []
+    for column, minimum in conditions.items():
+        if column not in schema.names:
+            return pc.scalar(False)
+        if pa.types.is_boolean(schema.field(column).type):
+            expressions.append(pc.field(column))
+        else:
+            expressions.append(pc.field(column) >= minimum)
+    if not expressions:
+        return pc.scalar(True)
+    return functools.reduce(operator.and_, expressions)
+
+
+def prefilter_smiles(
+    unique_smiles: list[str],
+    patterns: list[str],
+    any_patterns: list[str] = (),
+    descriptor_file: str = "descriptors/molecules.parquet",
+) -> list[str]:
+    """
+    Drop molecules that cannot match the query,
+    using descriptor columns instead of substructure matching.
+
+    Molecules without descriptors are always kept.
+
+    Parameters
+    ----------
+    unique_smiles : list[str]
+        The SMILES to filter. Their order is kept.
+    patterns : list[str]
+        SMARTS that must all match.
+    any_patterns : list[str], optional
+        SMARTS of which at least one must match.
+    descriptor_file : str, optional
+        The file written by ``build-descriptors.py``.
+
+    Returns
+    -------
+    list[str]
+        The SMILES that may match.
+    """
+    descriptors = ds.dataset(descriptor_file)
+    expression = functools.reduce(
+        operator.and_,
+        [
+            conditions_to_expression(derive_conditions(pattern), descriptors.schema)
+            for pattern in patterns
+        ],
+        pc.scalar(True),
+    )
+    if any_patterns:
+        expression &= functools.reduce(
+            operator.or_,
+            [
+                conditions_to_expression(derive_conditions(pattern), descriptors.schema)
+                for pattern in any_patterns
+            ],
+        )
+    print(f"Prefiltering with {expression}")
+
+    all_described = descriptors.to_table(columns=["smiles"])["smiles"]
+    candidates = descriptors.to_table(columns=["smiles"], filter=expression)["smiles"]
+    smiles_array = pa.array(unique_smiles, type=pa.string())
+    keep = pc.or_(
+        pc.is_in(smiles_array, value_set=candidates.combine_chunks()),
+        pc.invert(pc.is_in(smiles_array, value_set=all_described.combine_chunks())),
+    )
+    return smiles_array.filter(keep).to_pylist()
+
+
+def morgan_fingerprint(smiles: str, radius: int = 2, n_bits: int = 2048) -> np.ndarray:
+    """
+    Compute a Morgan fingerprint packed into bytes,
+    in the same way as ``build-fingerprints.py``.
+    """
+    from rdkit import Chem
+    from rdkit.Chem import rdFingerprintGenerator
+
+    rdmol = Chem.MolFromSmiles(smiles)
+    if rdmol is None:
+        raise ValueError(f"Could not parse SMILES {smiles}")
+    generator = rdFingerprintGenerator.GetMorganGenerator(radius=radius, fpSize=n_bits)
+    return np.packbits(generator.GetFingerprintAsNumPy(rdmol))
+
+
+def popcount(array: np.ndarray) -> np.ndarray:
+    """Count set bits over the last axis of an unsigned integer array."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(array).sum(axis=-1, dtype=np.int32)
+    as_bytes = array.view(np.uint8)
+    return np.unpackbits(as_bytes, axis=-1).sum(axis=-1, dtype=np.int32)
+
+
+def load_fingerprints(
+    fingerprint_file: str = "fingerprints/morgan.parquet",
+) -> tuple[pa.Array, np.ndarray, np.ndarray, dict[str, int]]:
+    """
+    Load the fingerprint matrix written by ``build-fingerprints.py``.
+
+    Returns
+    -------
+    smiles : pa.Array
+        The SMILES of each row.
+    fingerprints : np.ndarray
+        The packed fingerprints, with shape (n_molecules, n_bits // 64)
+        and dtype uint64.
+    bit_counts : np.ndarray
+        The number of bits set in each fingerprint.
+    parameters : dict[str, int]
+        The "radius" and "n_bits" the fingerprints were computed with.
+    """
+    table = pq.read_table(fingerprint_file)
+    metadata = table.schema.metadata
+    parameters = {
+        "radius": int(metadata[b"radius"]),
+        "n_bits": int(metadata[b"n_bits"]),
+    }
+    n_bytes = parameters["n_bits"] // 8
+
+    # view the fixed-size binary data buffer directly as a matrix
+    column = table["fingerprint"].combine_chunks()
+    fingerprints = np.frombuffer(
+        column.buffers()[1],
+        dtype=np.uint8,
+        count=len(column) * n_bytes,
+        offset=column.offset * n_bytes,
+    ).reshape(len(column), n_bytes).view(np.uint64)
+
+    bit_counts = table["bit_count"].to_numpy()
+    return table["smiles"].combine_chunks(), fingerprints, bit_counts, parameters
+
+
+def tanimoto_scores(
+    query: np.ndarray,
+    fingerprints: np.ndarray,
+    bit_counts: np.ndarray,
+    chunk_size: int = 16384,
+) -> np.ndarray:
+    """
+    Compute Tanimoto similarities of a packed query fingerprint
+    to every row of a packed fingerprint matrix, in chunks of rows.
+    """
+    query = query.view(np.uint64)
+    query_count = popcount(query)
+    scores = np.zeros(len(fingerprints), dtype=np.float32)
+    for i in range(0, len(fingerprints), chunk_size):
+        j = i + chunk_size
+        intersection = popcount(fingerprints[i:j] & query)
+        union = bit_counts[i:j] + query_count - intersection
+        np.divide(intersection, union, out=scores[i:j], where=union > 0)
+    return scores
+
+
+def get_similar_smiles(
+    query_smiles: str,
+    candidate_smiles: list[str],
+    fingerprint_file: str = "fingerprints/morgan.parquet",
+    threshold: float = 0.7,
+    top_k: int = 50,
+) -> list[tuple[str, float]]:
+    """
+    Find the candidate SMILES most similar to ``query_smiles``.
+
+    Parameters
+    ----------
+    query_smiles : str
+        The molecule to compare to.
+    candidate_smiles : list[str]
+        The SMILES that may be returned, e.g. after filtering datasets.
+    fingerprint_file : str, optional
+        The file written by ``build-fingerprints.py``.
+    threshold : float, optional
+        The minimum Tanimoto similarity, by default 0.7
+    top_k : int, optional
+        The maximum number of molecules to return, by default 50
+
+    Returns
+    -------
+    list[tuple[str, float]]
+        SMILES and their similarity, most similar first.
+    """
+    smiles, fingerprints, bit_counts, parameters = load_fingerprints(fingerprint_file)
+    query = morgan_fingerprint(query_smiles, **parameters)
+    scores = tanimoto_scores(query, fingerprints, bit_counts)
+
+    is_candidate = pc.is_in(smiles, value_set=pa.array(candidate_smiles, type=pa.string()))
+    keep = is_candidate.to_numpy(zero_copy_only=False) & (scores >= threshold)
+    indices = np.flatnonzero(keep)
+    if len(indices) > top_k:
+        indices = indices[np.argpartition(-scores[indices], top_k)[:top_k]]
+    indices = indices[np.argsort(-scores[indices], kind="stable")]
+
+    return [
+        (smiles[int(i)].as_py(), float(scores[i]))
+        for i in indices
+    ]
+
+
+def get_shard(smiles: str, n_shards: int) -> int:
+    """
+    Assign a SMILES to one of ``n_shards`` shards.
+
+    This uses CRC32 rather than ``hash``, which is salted per process,
+    so every worker agrees on the shards without sharing any state.
+    """
+    return zlib.crc32(smiles.encode("utf-8")) % n_shards
+
+
+def write_shard_matches(
+    matching_smiles: list[str],
+    output_directory: pathlib.Path,
+    shard_index: int,
+    n_shards: int,
+    query: str,
+) -> pathlib.Path:
+    """
+    Write the matches of one shard for ``load_shard_matches`` to merge.
+    ``query`` identifies the search, so shards of different searches
+    are not merged together.
+    """
+    table = pa.table({"smiles": pa.array(matching_smiles, type=pa.string())})
+    table = table.replace_schema_metadata(
+        {"shard_index": str(shard_index), "n_shards": str(n_shards), "query": query}
+    )
+    output_file = output_directory / f"matching_smiles_{shard_index}.parquet"
+    pq.write_table(table, output_file)
+    return output_file
+
+
+def load_shard_matches(shard_directory: str, query: str) -> list[str]:
+    """
+    Merge the matches written by ``write_shard_matches``
+    anywhere under ``shard_directory``.
+
+    Raises
+    ------
+    ValueError
+        If shards are missing, duplicated, or from a search other than ``query``.
+    """
+    files = sorted(pathlib.Path(shard_directory).glob("**/matching_smiles_*.parquet"))
+    if not files:
+        raise ValueError(f"No shard results found in {shard_directory}")
+
+    tables = [pq.read_table(file) for file in files]
+    for file, table in zip(files, tables):
+        shard_query = table.schema.metadata.get(b"query", b"").decode()
+        if shard_query != query:
+            raise ValueError(
+                f"Shard {file} is from a different search: {shard_query!r}, not {query!r}"
+            )
+    shard_indices = [int(table.schema.metadata[b"shard_index"]) for table in tables]
+    n_shards = {int(table.schema.metadata[b"n_shards"]) for table in tables}
+    if len(n_shards) != 1:
+        raise ValueError(f"Shard results have different numbers of shards: {n_shards}")
+    expected = list(range(n_shards.pop()))
+    if sorted(shard_indices) != expected:
+        raise ValueError(
+            f"Expected shards {expected} but found {sorted(shard_indices)}"
+        )
+
+    merged = pa.concat_tables(tables)["smiles"].to_pylist()
+    print(f"Merged {len(merged)} matches from {len(tables)} shards")
+    return sorted(merged)
+
+
 def draw_grid_df(
-    df,
+    smiles_counts: pa.Table,
     use_svg: bool = True,
     output_file: str = None,
     n_col: int = 4,
@@ -35,8 +654,9 @@ def draw_grid_df(
 
     Parameters
     ----------
-    df : pd.DataFrame
-        The dataframe containing the molecules to draw.
+    smiles_counts : pa.Table
+        The molecules to draw, with "smiles" and "smiles_count"
+        columns, as from ``count_matches``.
     use_svg : bool, optional
         Whether to use SVG format, by default True
     output_file : str, optional
@@ -63,14 +683,13 @@ def draw_grid_df(
     rdmols = []
     legends = []
     n_confs = []
-    unique_smiles = df["smiles"].unique()
-    for smiles in unique_smiles[:max_mols]:
+    unique_smiles = smiles_counts["smiles"].to_pylist()
+    conformer_counts = smiles_counts["smiles_count"].to_pylist()
+    for smiles, n_conf in zip(unique_smiles[:max_mols], conformer_counts[:max_mols]):
         mol = Molecule.from_smiles(smiles, allow_undefined_stereo=True)
         rdmol = mol.to_rdkit()
         rdmols.append(rdmol)
 
-        subdf = df[df["smiles"] == smiles]
-        n_conf = len(subdf)
         legend = f"{n_conf} conformers"
         legends.append(legend)
         n_confs.append(n_conf)
@@ -188,8 +807,222 @@ def get_dataset_and_command_suffix(
 
 
 
+def count_matches(
+    table: pa.Table,
+    keys: list[str] = COUNT_KEYS,
+) -> pa.Table:
+    """
+    Count matching conformers per group.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The table of matching molecules.
+    keys : list[str], optional
+        The columns to group by, by default ``COUNT_KEYS``
+
+    Returns
+    -------
+    pa.Table
+        A table with the ``keys`` columns and a "smiles_count" column.
+    """
+    counts = table.group_by(keys).aggregate([("smiles", "count")])
+    return counts.select(keys + ["smiles_count"])
+
+
+def merge_counts(
+    partial_counts: list[pa.Table],
+    keys: list[str] = COUNT_KEYS,
+) -> pa.Table:
+    """
+    Merge partial outputs of ``count_matches`` into one table of counts.
+
+    Parameters
+    ----------
+    partial_counts : list[pa.Table]
+        Tables from ``count_matches`` over disjoint sets of rows.
+    keys : list[str], optional
+        The columns that were grouped by, by default ``COUNT_KEYS``
+
+    Returns
+    -------
+    pa.Table
+        A table with the ``keys`` columns and a "smiles_count" column.
+    """
+    counts = pa.concat_tables(partial_counts)
+    counts = counts.group_by(keys).aggregate([("smiles_count", "sum")])
+    counts = counts.select(keys + ["smiles_count_sum"])
+    return counts.rename_columns(keys + ["smiles_count"])
+
+
+def format_counts(counts: pa.Table) -> pd.DataFrame:
+    """
+    Sort and rename counts for the markdown table in the comment.
+    This is the only part of the results that goes through pandas.
+    """
+    counts = counts.sort_by([(key, "ascending") for key in COUNT_KEYS])
+    counts = counts.rename_columns(COUNT_KEYS + ["# conformers"])
+    return counts.to_pandas()
+
+
+def open_match_writer(
+    output_directory: pathlib.Path,
+    schema: pa.Schema,
+    output_format: str = "csv",
+):
+    """
+    Open an Arrow writer for matching molecules.
+
+    Parameters
+    ----------
+    output_directory : pathlib.Path
+        The directory to write to.
+    schema : pa.Schema
+        The schema of the tables or batches that will be written.
+    output_format : str, optional
+        One of "csv", "csv.gz" or "parquet", by default "csv"
+
+    Returns
+    -------
+    output_file : pathlib.Path
+        The file that will be written.
+    writer : pq.ParquetWriter or pcsv.CSVWriter
+        The writer. Both kinds support ``write_batch``, ``write_table``
+        and use as a context manager.
+    """
+    output_file = output_directory / f"matching_molecules.{output_format}"
+    if output_format == "parquet":
+        return output_file, pq.ParquetWriter(output_file, schema)
+
+    sink = str(output_file)
+    if output_format == "csv.gz":
+        sink = pa.CompressedOutputStream(sink, "gzip")
+    return output_file, pcsv.CSVWriter(sink, schema)
+
+
+def write_matches(
+    table: pa.Table,
+    output_directory: pathlib.Path,
+    output_format: str = "csv",
+) -> pathlib.Path:
+    """
+    Write matching molecules with Arrow writers.
+
+    Parameters
+    ----------
+    table : pa.Table
+        The table of matching molecules.
+    output_directory : pathlib.Path
+        The directory to write to.
+    output_format : str, optional
+        One of "csv", "csv.gz" or "parquet", by default "csv"
+
+    Returns
+    -------
+    pathlib.Path
+        The written file.
+    """
+    output_file, writer = open_match_writer(
+        output_directory, table.schema, output_format
+    )
+    with writer:
+        writer.write_table(table)
+    return output_file
+
+
+def stream_matches(
+    dataset: ds.Dataset,
+    expression: pc.Expression,
+    output_directory: pathlib.Path,
+    output_format: str = "csv",
+    batch_size: int = 65536,
+    max_memory: int = 1024,
+) -> tuple[pathlib.Path, pa.Table, pa.Table]:
+    """
+    Write matching molecules batch by batch, counting them on the fly.
+
+    Only one batch of rows is held in memory at a time.
+    Counts from each batch are buffered and merged once the buffer
+    exceeds ``max_memory``. Merged counts must fit in half of
+    ``max_memory``, so each merge is followed by at least that much
+    new buffering and the counts never take much more than ``max_memory``.
+
+    Parameters
+    ----------
+    dataset : ds.Dataset
+        The dataset to scan.
+    expression : pc.Expression
+        The filter selecting matching rows.
+    output_directory : pathlib.Path
+        The directory to write to.
+    output_format : str, optional
+        One of "csv", "csv.gz" or "parquet", by default "csv"
+    batch_size : int, optional
+        The maximum number of rows per batch, by default 65536
+    max_memory : int, optional
+        The cap on memory used by the counts in MiB, by default 1024.
+        This does not include the current batch, set by ``batch_size``.
+
+    Returns
+    -------
+    output_file : pathlib.Path
+        The written file.
+    counts : pa.Table
+        Counts per ``COUNT_KEYS``, as from ``count_matches``.
+    smiles_counts : pa.Table
+        Counts per SMILES, as from ``count_matches``.
+
+    Raises
+    ------
+    ValueError
+        If the merged counts need more than half of ``max_memory``.
+    """
+    max_bytes = max_memory * 1024 ** 2
+    scanner = dataset.scanner(
+        columns=MATCH_COLUMNS,
+        filter=expression,
+        batch_size=batch_size,
+        batch_readahead=1,
+        fragment_readahead=1,
+    )
+    output_file, writer = open_match_writer(
+        output_directory, scanner.projected_schema, output_format
+    )
+
+    partial_counts = []
+    partial_smiles_counts = []
+    n_buffered_bytes = 0
+    with writer:
+        for batch in tqdm.tqdm(scanner.to_batches(), desc="Writing matches"):
+            if not batch.num_rows:
+                continue
+            writer.write_batch(batch)
+
+            table = pa.Table.from_batches([batch])
+            partial_counts.append(count_matches(table))
+            partial_smiles_counts.append(count_matches(table, ["smiles"]))
+            n_buffered_bytes += partial_counts[-1].nbytes + partial_smiles_counts[-1].nbytes
+            if n_buffered_bytes <= max_bytes:
+                continue
+
+            partial_counts = [merge_counts(partial_counts)]
+            partial_smiles_counts = [
+                merge_counts(partial_smiles_counts, ["smiles"])
+            ]
+            n_buffered_bytes = partial_counts[0].nbytes + partial_smiles_counts[0].nbytes
+            if n_buffered_bytes > max_bytes / 2:
+                raise ValueError(
+                    f"Counts of matches need {n_buffered_bytes / 1024 ** 2:.1f} MiB, "
+                    f"more than half of --max-memory {max_memory} MiB"
+                )
+
+    counts = merge_counts(partial_counts)
+    smiles_counts = merge_counts(partial_smiles_counts, ["smiles"])
+    return output_file, counts, smiles_counts
+
+
 def draw_molecules(
-    df,
+    smiles_counts: pa.Table,
     repo,
     output_directory: pathlib.Path,
     workflow_run_id: str,
@@ -200,7 +1033,7 @@ def draw_molecules(
     molecule_directory = output_directory / "molecules"
     molecule_directory.mkdir(exist_ok=True, parents=True)
     filenames = draw_grid_df(
-        df,
+        smiles_counts,
         output_file=molecule_directory / "molecules.png",
         max_mols=max_mols,
     )
@@ -287,11 +1120,32 @@ def post_discussion_comment(
 @click.command()
 @click.option(
     "--pattern",
+    "patterns",
     type=str,
+    multiple=True,
+    default=[],
+    help="SMARTS that must match. Can be given multiple times.",
+)
+@click.option(
+    "--exclude",
+    "excludes",
+    type=str,
+    multiple=True,
+    default=[],
+    help="SMARTS that must not match. Can be given multiple times.",
+)
+@click.option(
+    "--any",
+    "any_patterns",
+    type=str,
+    multiple=True,
+    default=[],
+    help="SMARTS of which at least one must match. Can be given multiple times.",
 )
 @click.option(
     "--output-directory",
-    type=click.Path(exists=False, dir_okay=True, file_okay=False)
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    default="artifact",
 )
 @click.option(
     "--discussion-id",
@@ -321,6 +1175,44 @@ def post_discussion_comment(
     multiple=True,
     default=[],
 )
+@click.option(
+    "--similar",
+    type=str,
+    default=None,
+    help="Search for molecules similar to this SMILES.",
+)
+@click.option(
+    "--threshold",
+    type=float,
+    default=0.7,
+    help="Minimum Tanimoto similarity for --similar.",
+)
+@click.option(
+    "--top-k",
+    type=int,
+    default=50,
+    help="Maximum number of molecules returned for --similar.",
+)
+@click.option(
+    "--fingerprint-file",
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    default="fingerprints/morgan.parquet",
+)
+@click.option(
+    "--descriptor-file",
+    type=click.Path(exists=False, dir_okay=False, file_okay=True),
+    default="descriptors/molecules.parquet",
+    help=(
+        "Descriptors from build-descriptors.py, used to skip molecules "
+        "that cannot match before any substructure matching."
+    ),
+)
+@click.option(
+    "--no-prefilter",
+    is_flag=True,
+    default=False,
+    help="Match every molecule, without prefiltering on descriptors.",
+)
 @click.option(
     "--combination",
     "combinations",
@@ -342,8 +1234,82 @@ def post_discussion_comment(
     type=int,
     default=200,
 )
+@click.option(
+    "--backend",
+    type=click.Choice(sorted(BACKENDS)),
+    default="openff",
+    help=(
+        "How to match SMARTS. 'openff' goes through the OpenFF toolkit; "
+        "'rdkit' calls RDKit directly, compiling each query once."
+    ),
+)
+@click.option(
+    "--n-shards",
+    type=int,
+    default=None,
+    help=(
+        "Split the molecules into this many shards and only search "
+        "the one given by --shard-index. Writes the shard's matches to "
+        "--output-directory without posting anything."
+    ),
+)
+@click.option(
+    "--shard-index",
+    type=int,
+    default=None,
+)
+@click.option(
+    "--merge-shards",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default=None,
+    help="Instead of searching, merge the shard results under this directory.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue from the checkpoint in --output-directory, if there is one.",
+)
+@click.option(
+    "--checkpoint-every",
+    type=int,
+    default=1000,
+    help="How many molecules to search between checkpoints.",
+)
+@click.option(
+    "--dry-run",
+    is_flag=True,
+    default=False,
+    help="Draw molecules locally and print the comment instead of posting it.",
+)
+@click.option(
+    "--output-format",
+    type=click.Choice(["csv", "csv.gz", "parquet"]),
+    default="csv",
+)
+@click.option(
+    "--stream",
+    is_flag=True,
+    default=False,
+    help="Write and count matches batch by batch in bounded memory.",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=65536,
+    help="Maximum number of rows per batch when streaming.",
+)
+@click.option(
+    "--max-memory",
+    type=int,
+    default=1024,
+    help=(
+        "Cap in MiB on the memory used by match counts when streaming. "
+        "The search fails if the counts need more than half of it."
+    ),
+)
 def main(
-    pattern: str,
+    patterns: list[str],
     output_directory: str,
     discussion_id: int,
     workflow_run_id: str,
@@ -352,11 +1318,46 @@ def main(
     types: list[str] = None,
     combinations: list[str] = None,
     combinations_directory: str = "combinations",
+    excludes: list[str] = None,
+    any_patterns: list[str] = None,
+    similar: str = None,
+    threshold: float = 0.7,
+    top_k: int = 50,
+    fingerprint_file: str = "fingerprints/morgan.parquet",
+    descriptor_file: str = "descriptors/molecules.parquet",
+    no_prefilter: bool = False,
     max_mols: int = 200,
+    backend: str = "openff",
+    n_shards: int = None,
+    shard_index: int = None,
+    merge_shards: str = None,
+    resume: bool = False,
+    checkpoint_every: int = 1000,
+    dry_run: bool = False,
+    output_format: str = "csv",
+    stream: bool = False,
+    batch_size: int = 65536,
+    max_memory: int = 1024,
 ):
-    g = Github(os.environ['GITHUB_TOKEN'])
-    repo = g.get_repo(REPO_NAME)
-    
+    if not patterns and not any_patterns and not similar:
+        raise click.UsageError("At least one --pattern, --any or --similar must be given")
+
+    load_molecule, match_function = BACKENDS[backend]
+    planner = None
+    if patterns or excludes or any_patterns:
+        planner = QueryPlanner(
+            patterns=patterns,
+            excludes=excludes,
+            any_patterns=any_patterns,
+            match_function=match_function,
+        )
+
+    if (n_shards is None) != (shard_index is None):
+        raise click.UsageError("--n-shards and --shard-index must be given together")
+    if n_shards is not None and not 0 <= shard_index < n_shards:
+        raise click.UsageError(f"--shard-index must be between 0 and {n_shards - 1}")
+    output_directory = pathlib.Path(output_directory)
+
     dataset, command_suffix = get_dataset_and_command_suffix(
         specs=specs,
         datasets=datasets,
@@ -369,18 +1370,124 @@ def main(
     all_smiles = dataset.to_table(
         columns=["smiles"]
     ).to_pydict()["smiles"]
-    unique_smiles = list(set(all_smiles))
+    # sorted so that a resumed search visits molecules in the same order
+    unique_smiles = sorted(set(all_smiles))
 
-    matching_smiles = []
-    for smiles in tqdm.tqdm(
-        unique_smiles,
-        desc="Searching SMILES",
-    ):
-        mol = Molecule.from_smiles(smiles, allow_undefined_stereo=True)
-        if mol.chemical_environment_matches(pattern):
-            matching_smiles.append(smiles)
+    cmd = "botsearch"
+    similarities = {}
+    if similar:
+        similarities = dict(get_similar_smiles(
+            similar,
+            unique_smiles,
+            fingerprint_file=fingerprint_file,
+            threshold=threshold,
+            top_k=top_k,
+        ))
+        print(f"Found {len(similarities)} molecules similar to {similar}")
+        # any patterns are then only checked against the similar molecules
+        unique_smiles = list(similarities)
+        cmd += f" --similar '{similar}' --threshold {threshold} --top-k {top_k}"
 
-    cmd = f"botsearch --pattern '{pattern}'" + command_suffix
+    if planner is not None:
+        cmd += planner.to_command()
+    cmd += command_suffix
+
+    # exclude clauses give no conditions, so there is nothing to prefilter on
+    if (patterns or any_patterns) and not merge_shards and not no_prefilter:
+        if pathlib.Path(descriptor_file).exists():
+            n_molecules = len(unique_smiles)
+            unique_smiles = prefilter_smiles(
+                unique_smiles,
+                patterns,
+                any_patterns,
+                descriptor_file=descriptor_file,
+            )
+            print(f"Prefiltered {n_molecules} molecules to {len(unique_smiles)} candidates")
+        else:
+            print(f"No descriptors found at {descriptor_file}, not prefiltering")
+
+    if n_shards is not None:
+        unique_smiles = [
+            smiles
+            for smiles in unique_smiles
+            if get_shard(smiles, n_shards) == shard_index
+        ]
+        print(f"Searching {len(unique_smiles)} molecules in shard {shard_index}")
+
+    # identifies the search for checkpoints and shard results
+    query = f"{cmd} --backend {backend}"
+
+    if merge_shards:
+        matching_smiles = load_shard_matches(merge_shards, query)
+    elif planner is None:
+        matching_smiles = unique_smiles
+    else:
+        output_directory.mkdir(exist_ok=True, parents=True)
+        checkpoint_file = output_directory / "search.checkpoint.json"
+        checkpoint_key = (
+            f"{query} --n-shards {n_shards} "
+            f"--shard-index {shard_index} ({len(unique_smiles)} molecules)"
+        )
+        checkpoint = {}
+        if resume:
+            checkpoint = checkpoints.load_checkpoint(checkpoint_file, checkpoint_key)
+        n_processed = checkpoint.get("n_processed", 0)
+        checkpoints.remove_chunks(checkpoint_file, start=n_processed)
+        matching_smiles = []
+        if n_processed:
+            saved_matches = checkpoints.load_chunks(checkpoint_file)
+            if saved_matches is not None:
+                matching_smiles = saved_matches["smiles"].to_pylist()
+            print(f"Resuming from {n_processed} molecules and {len(matching_smiles)} matches")
+        n_saved = len(matching_smiles)
+
+        for i, smiles in enumerate(
+            tqdm.tqdm(
+                unique_smiles[n_processed:],
+                desc="Searching SMILES",
+                initial=n_processed,
+                total=len(unique_smiles),
+            ),
+            start=n_processed + 1,
+        ):
+            try:
+                mol = load_molecule(smiles)
+            except Exception as e:
+                # neither backend can load e.g. hypervalent SMILES,
+                # so these never match
+                print(f"Skipping {smiles}: {e}")
+            else:
+                if planner.evaluate(mol):
+                    matching_smiles.append(smiles)
+
+            if not i % checkpoint_every:
+                # only the matches since the last checkpoint are written
+                new_matches = matching_smiles[n_saved:]
+                if new_matches:
+                    checkpoints.save_chunk(
+                        checkpoint_file,
+                        n_processed,
+                        pa.table({"smiles": pa.array(new_matches, type=pa.string())}),
+                    )
+                n_saved = len(matching_smiles)
+                n_processed = i
+                checkpoints.save_checkpoint(
+                    checkpoint_file,
+                    {"key": checkpoint_key, "n_processed": n_processed},
+                )
+        checkpoints.remove_chunks(checkpoint_file)
+        checkpoint_file.unlink(missing_ok=True)
+
+        for clause in planner.clauses:
+            print(clause)
+
+    if n_shards is not None:
+        output_directory.mkdir(exist_ok=True, parents=True)
+        output_file = write_shard_matches(
+            matching_smiles, output_directory, shard_index, n_shards, query
+        )
+        print(f"Saved {len(matching_smiles)} matches of shard {shard_index} to {output_file}")
+        return
 
 
     comment = textwrap.dedent(
@@ -400,35 +1507,52 @@ def main(
         )
     else:
         expression = pc.field("smiles").isin(matching_smiles)
-        df = dataset.filter(expression).to_table(
-            columns=["type", "dataset", "specification", "smiles", "qcarchive_id", "torsiondrive_id"]
-        ).to_pandas()
-        
-        output_directory = pathlib.Path(output_directory)
         output_directory.mkdir(exist_ok=True, parents=True)
-        csv = output_directory / "matching_molecules.csv"
-        df.to_csv(csv, index=False)
-        print(f"Saved {len(df)} matching molecules to {csv}")
+
+        if stream:
+            output_file, counts, smiles_counts = stream_matches(
+                dataset,
+                expression,
+                output_directory,
+                output_format=output_format,
+                batch_size=batch_size,
+                max_memory=max_memory,
+            )
+        else:
+            table = dataset.filter(expression).to_table(columns=MATCH_COLUMNS)
+            output_file = write_matches(table, output_directory, output_format)
+            counts = count_matches(table)
+            smiles_counts = count_matches(table, ["smiles"])
+            del table
+        n_conformers = pc.sum(counts["smiles_count"]).as_py()
+        n_datasets = pc.count_distinct(counts["dataset"]).as_py()
+        print(f"Saved {n_conformers} matching molecules to {output_file}")
 
         # draw as PNGs
-        commit_sha, embedded_files = draw_molecules(
-            df,
-            repo,
-            output_directory,
-            workflow_run_id,
-            max_mols=max_mols,
-        )
+        if dry_run:
+            embedded_files = draw_grid_df(
+                smiles_counts,
+                output_file=output_directory / "molecules" / "molecules.png",
+                max_mols=max_mols,
+            )
+        else:
+            g = Github(os.environ['GITHUB_TOKEN'])
+            repo = g.get_repo(REPO_NAME)
+            commit_sha, embedded_files = draw_molecules(
+                smiles_counts,
+                repo,
+                output_directory,
+                workflow_run_id,
+                max_mols=max_mols,
+            )
 
-        counts = df.groupby(by=["type", "dataset", "specification"]).count().reset_index()
-        counts = counts[["type", "dataset", "specification", "smiles"]]
-        counts = counts.rename(columns={"smiles": "# conformers"})
-        counts = counts.sort_values(by=["type", "dataset", "specification"])
+        counts = format_counts(counts)
 
         comment += textwrap.dedent(
             f"""
             Unique matches: {len(matching_smiles)}
-            Matching conformers: {len(df)}
-            Number of datasets: {len(df.dataset.unique())}
+            Matching conformers: {n_conformers}
+            Number of datasets: {n_datasets}
 
             ## Counts
 
@@ -439,13 +1563,29 @@ def main(
             """
         ) + counts.to_markdown(index=False) + "\n\n</details>"
 
+        if similarities:
+            similarity_df = pd.DataFrame(
+                [
+                    (smiles, similarities[smiles])
+                    for smiles in matching_smiles
+                ],
+                columns=["smiles", "Tanimoto similarity"],
+            )
+            # matches are in SMILES order, e.g. after merging shards
+            similarity_df = similarity_df.sort_values(
+                ["Tanimoto similarity", "smiles"],
+                ascending=[False, True],
+            )
+            comment += "\n\n## Similarity\n\n<details>\n\n<summary>Click to expand for similarities</summary>\n\n"
+            comment += similarity_df.to_markdown(index=False, floatfmt=".3f")
+            comment += "\n\n</details>"
 
         molecule_file_texts = []
         for file in embedded_files:
             molecule_file_texts.append(f"![{file}](../blob/assets/{file}?raw=true)")
             # molecule_file_texts.append(f"![{file}](../blob/{commit_sha}/{file}?raw=true)")
         comment += "\n\n## Molecules\n\n<details>\n\n<summary>Click to expand for molecules</summary>\n\n"
-        if len(df.smiles.unique()) > max_mols:
+        if len(matching_smiles) > max_mols:
             comment += f"Too many molecules to display. Drawing a random {max_mols} molecules.\n\n"
         comment += "\n\n".join(molecule_file_texts)
         comment += "\n\n</details>"
@@ -454,8 +1594,11 @@ def main(
         artifact_link = f"https://github.com/{REPO_NAME}/actions/runs/{workflow_run_id}"
         comment += "\n\n## Artifacts\n\n"
         comment += f"See the artifacts at the [GitHub Actions run]({artifact_link}). They will expire in 7 days."
-    
-    post_discussion_comment(discussion_id=discussion_id, comment=comment)
+
+    if dry_run:
+        print(comment)
+    else:
+        post_discussion_comment(discussion_id=discussion_id, comment=comment)
 
 
 if __name__ == "__main__":
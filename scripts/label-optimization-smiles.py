@@ -1,4 +1,5 @@
 import json
+import os
 import pathlib
 
 import click
@@ -9,6 +10,8 @@ import pyarrow as pa
 import pyarrow.parquet as pq
 from openff.toolkit import Molecule
 
+import checkpoints
+
 def canonicalize_smiles(smi: str) -> str:
     mol = Molecule.from_smiles(smi, allow_undefined_stereo=True)
     return mol.to_smiles(isomeric=True, explicit_hydrogens=False)
@@ -23,9 +26,23 @@ def canonicalize_smiles(smi: str) -> str:
     "--output-directory",
     type=click.Path(exists=False, dir_okay=True, file_okay=False)
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue from the checkpoint next to the output file, if there is one.",
+)
+@click.option(
+    "--checkpoint-every",
+    type=int,
+    default=1000,
+    help="How many SMILES to canonicalize between checkpoints.",
+)
 def main(
     input_file: str,
     output_directory: str,
+    resume: bool = False,
+    checkpoint_every: int = 1000,
 ):
     # parse optimizations
 
@@ -37,16 +54,36 @@ def main(
     df = pd.DataFrame(entries)
     df = df.rename(columns={"record_id": "qcarchive_id"})
 
-    MAPPED_SMILES_TO_SMILES = {
-        smi: canonicalize_smiles(smi)
-        for smi in tqdm.tqdm(
-            df.cmiles.unique(),
-            desc="Canonicalizing SMILES",
-        )
-    }
-
     dataset = pathlib.Path(input_file).stem
     spec = pathlib.Path(input_file).parent.name
+    output_directory = pathlib.Path(output_directory)
+    output_file = output_directory / spec / f"{dataset}.parquet"
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+
+    # hidden, so the checkpoint is not read as part of the tables dataset
+    checkpoint_file = output_file.parent / f".{dataset}.checkpoint.json"
+    checkpoint_key = f"{input_file} ({os.path.getsize(input_file)} bytes)"
+    checkpoint = {}
+    if resume:
+        checkpoint = checkpoints.load_checkpoint(checkpoint_file, checkpoint_key)
+
+    MAPPED_SMILES_TO_SMILES = checkpoint.get("canonical_smiles", {})
+    unique_cmiles = sorted(df.cmiles.unique())
+    for i, smi in enumerate(
+        tqdm.tqdm(
+            unique_cmiles,
+            desc="Canonicalizing SMILES",
+        ),
+        start=1,
+    ):
+        if smi not in MAPPED_SMILES_TO_SMILES:
+            MAPPED_SMILES_TO_SMILES[smi] = canonicalize_smiles(smi)
+        if not i % checkpoint_every:
+            checkpoints.save_checkpoint(
+                checkpoint_file,
+                {"key": checkpoint_key, "canonical_smiles": MAPPED_SMILES_TO_SMILES},
+            )
+
     df["smiles"] = [
         MAPPED_SMILES_TO_SMILES[smi]
         for smi in df.cmiles.values
@@ -58,10 +95,8 @@ def main(
     df["grid_ids"] = [[-1] for _ in range(len(df))]
     table = pa.Table.from_pandas(df)
     
-    output_directory = pathlib.Path(output_directory)
-    output_file = output_directory / spec / f"{dataset}.parquet"
-    output_file.parent.mkdir(exist_ok=True, parents=True)
     pq.write_table(table, output_file)
+    checkpoint_file.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
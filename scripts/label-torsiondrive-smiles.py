@@ -1,4 +1,4 @@
-import json
+import os
 import pathlib
 
 import click
@@ -9,6 +9,10 @@ import pyarrow as pa
 import pyarrow.parquet as pq
 from openff.toolkit import Molecule
 
+import checkpoints
+
+QCARCHIVE_ADDRESS = "https://api.qcarchive.molssi.org:443/"
+
 def canonicalize_smiles(smi: str) -> str:
     mol = Molecule.from_smiles(smi, allow_undefined_stereo=True)
     return mol.to_smiles(isomeric=True, explicit_hydrogens=False)
@@ -23,9 +27,27 @@ def canonicalize_smiles(smi: str) -> str:
     "--output-directory",
     type=click.Path(exists=False, dir_okay=True, file_okay=False)
 )
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue from the checkpoint next to the output file, if there is one.",
+)
+@click.option(
+    "--checkpoint-every",
+    type=int,
+    default=1000,
+    help=(
+        "How many SMILES to canonicalize, or torsiondrive records to fetch "
+        "and label, between checkpoints. "
+        "Records are fetched from QCArchive in chunks of this size."
+    ),
+)
 def main(
     input_file: str,
     output_directory: str,
+    resume: bool = False,
+    checkpoint_every: int = 1000,
 ):
     from openff.qcsubmit.results import TorsionDriveResultCollection
 
@@ -33,47 +55,98 @@ def main(
     spec = pathlib.Path(input_file).parent.name
     dataset = TorsionDriveResultCollection.parse_file(input_file)
 
+    output_directory = pathlib.Path(output_directory)
+    output_file = output_directory / spec / f"{dataset_name}.parquet"
+    output_file.parent.mkdir(exist_ok=True, parents=True)
+
+    # dot-prefixed, so pyarrow.dataset skips it and its chunks in tables/
+    checkpoint_file = output_file.parent / f".{dataset_name}.checkpoint.json"
+    checkpoint_key = f"{input_file} ({os.path.getsize(input_file)} bytes)"
+    checkpoint = {}
+    if resume:
+        checkpoint = checkpoints.load_checkpoint(checkpoint_file, checkpoint_key)
+
+    # labelled entries are saved in chunks, so this only records progress
+    def write_checkpoint():
+        checkpoints.save_checkpoint(
+            checkpoint_file,
+            {
+                "key": checkpoint_key,
+                "canonical_smiles": cmiles_to_smiles,
+                "n_records_processed": n_records_processed,
+            },
+        )
+
+    entries = dataset.entries[QCARCHIVE_ADDRESS]
     td_record_to_cmiles_and_inchi = {
         entry.record_id: (entry.cmiles, entry.inchi_key)
-        for entry in dataset.entries['https://api.qcarchive.molssi.org:443/']
+        for entry in entries
     }
 
-    unique_cmiles = set(cmiles for cmiles, _ in td_record_to_cmiles_and_inchi.values())
-    cmiles_to_smiles = {
-        cmiles: canonicalize_smiles(cmiles)
-        for cmiles in tqdm.tqdm(unique_cmiles, desc="Canonicalizing SMILES")
-    }
+    unique_cmiles = sorted(set(cmiles for cmiles, _ in td_record_to_cmiles_and_inchi.values()))
+    cmiles_to_smiles = checkpoint.get("canonical_smiles", {})
+    n_records_processed = checkpoint.get("n_records_processed", 0)
 
-    records_and_molecules = dataset.to_records()
-    all_entries = []
-    for record, openff_molecule in tqdm.tqdm(records_and_molecules):
-        cmiles, inchi_key = td_record_to_cmiles_and_inchi[record.id]
-
-        dihedrals = [
-            list(dih)
-            for dih in record.specification.keywords.dihedrals
-        ]
-
-        for grid_id, optimization in record.minimum_optimizations.items():
-            entry = {
-                "type": "torsiondrive",
-                "qcarchive_id": optimization.id,
-                "cmiles": cmiles,
-                "inchi_key": inchi_key,
-                "smiles": cmiles_to_smiles[cmiles],
-                "dataset": dataset_name,
-                "specification": spec,
-                "torsiondrive_id": record.id,
-                "dihedral_indices": dihedrals,
-                "grid_ids": list(grid_id),
-            }
-            all_entries.append(entry)
-
-    table = pa.Table.from_pylist(all_entries)
-    output_directory = pathlib.Path(output_directory)
-    output_file = output_directory / spec / f"{dataset_name}.parquet"
-    output_file.parent.mkdir(exist_ok=True, parents=True)
+    checkpoints.remove_chunks(checkpoint_file, start=n_records_processed)
+
+    for i, cmiles in enumerate(
+        tqdm.tqdm(unique_cmiles, desc="Canonicalizing SMILES"),
+        start=1,
+    ):
+        if cmiles not in cmiles_to_smiles:
+            cmiles_to_smiles[cmiles] = canonicalize_smiles(cmiles)
+        if not i % checkpoint_every:
+            write_checkpoint()
+    write_checkpoint()
+
+    # fetch records in chunks so that only the current chunk is lost on interruption
+    progress = tqdm.tqdm(
+        total=len(entries),
+        initial=n_records_processed,
+        desc="Labelling records",
+    )
+    for start in range(n_records_processed, len(entries), checkpoint_every):
+        chunk = TorsionDriveResultCollection(
+            entries={QCARCHIVE_ADDRESS: entries[start:start + checkpoint_every]}
+        )
+        records_and_molecules = chunk.to_records()
+        chunk_entries = []
+        for record, openff_molecule in records_and_molecules:
+            cmiles, inchi_key = td_record_to_cmiles_and_inchi[record.id]
+
+            dihedrals = [
+                list(dih)
+                for dih in record.specification.keywords.dihedrals
+            ]
+
+            for grid_id, optimization in record.minimum_optimizations.items():
+                entry = {
+                    "type": "torsiondrive",
+                    "qcarchive_id": optimization.id,
+                    "cmiles": cmiles,
+                    "inchi_key": inchi_key,
+                    "smiles": cmiles_to_smiles[cmiles],
+                    "dataset": dataset_name,
+                    "specification": spec,
+                    "torsiondrive_id": record.id,
+                    "dihedral_indices": dihedrals,
+                    "grid_ids": list(grid_id),
+                }
+                chunk_entries.append(entry)
+
+        if chunk_entries:
+            checkpoints.save_chunk(checkpoint_file, start, pa.Table.from_pylist(chunk_entries))
+        n_records_processed = min(start + checkpoint_every, len(entries))
+        progress.update(n_records_processed - progress.n)
+        write_checkpoint()
+    progress.close()
+
+    table = checkpoints.load_chunks(checkpoint_file)
+    if table is None:
+        table = pa.Table.from_pylist([])
     pq.write_table(table, output_file)
+    checkpoints.remove_chunks(checkpoint_file)
+    checkpoint_file.unlink(missing_ok=True)
 
 
 if __name__ == "__main__":
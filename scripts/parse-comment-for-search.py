@@ -1,8 +1,14 @@
 import click
 import re
 
-SMILES_PATTERN = re.compile("-pattern\s+[\'\"]*([0-9a-zA-Z\,\+\(\)\$\:\!\&\-\=\#\~\[\]]+)[\'\"]*", re.IGNORECASE)
+SMARTS_CHARACTERS = "[\'\"]*([0-9a-zA-Z\,\+\(\)\$\:\!\&\-\=\#\~\[\]]+)[\'\"]*"
+SMILES_PATTERN = re.compile("-pattern\s+" + SMARTS_CHARACTERS, re.IGNORECASE)
+EXCLUDE_PATTERN = re.compile("-exclude\s+" + SMARTS_CHARACTERS, re.IGNORECASE)
+ANY_PATTERN = re.compile("-any\s+" + SMARTS_CHARACTERS, re.IGNORECASE)
+SIMILAR_PATTERN = re.compile("-similar\s+[\'\"]*([0-9a-zA-Z\@\+\-\[\]\(\)\\\/\%\=\#\$\.\:\*\~]+)[\'\"]*", re.IGNORECASE)
 MAX_MOLS_PATTERN = re.compile("-max-mols\s+([0-9]+)", re.IGNORECASE)
+THRESHOLD_PATTERN = re.compile("-threshold\s+([0-9]*\.?[0-9]+)", re.IGNORECASE)
+TOP_K_PATTERN = re.compile("-top-k\s+([0-9]+)", re.IGNORECASE)
 
 
 REGEXES = {
@@ -20,19 +26,23 @@ REGEXES = {
 def main(
     text: str,
 ):
-    matches = SMILES_PATTERN.findall(text)
-    if len(matches) == 0:
+    clauses = {
+        "pattern": SMILES_PATTERN.findall(text),
+        "exclude": EXCLUDE_PATTERN.findall(text),
+        "any": ANY_PATTERN.findall(text),
+    }
+    similar_matches = SIMILAR_PATTERN.findall(text)
+    if not clauses["pattern"] and not clauses["any"] and not similar_matches:
         raise ValueError(f"Pattern {text} does not contain any SMILES.")
+    if len(similar_matches) > 1:
+        raise ValueError(f"Pattern {text} contains multiple similar SMILES.")
 
-    if len(matches) > 1:
-        raise ValueError(f"Pattern {text} contains multiple SMILES.")
-
-    smiles = matches[0]
-
-    command = (
-        "python scripts/get-smiles-matches.py "
-        f"--pattern '{smiles}'"
-    )
+    command = "python scripts/get-smiles-matches.py"
+    for smiles in similar_matches:
+        command += f" --similar '{smiles}'"
+    for key, smarts in clauses.items():
+        for smiles in smarts:
+            command += f" --{key} '{smiles}'"
 
     for key, pattern in REGEXES.items():
         matches = pattern.findall(text)
@@ -46,6 +56,13 @@ def main(
     for match in max_mols_matches:
         command += f" --max-mols {match}"
 
+    for flag, pattern in [("threshold", THRESHOLD_PATTERN), ("top-k", TOP_K_PATTERN)]:
+        matches = pattern.findall(text)
+        if len(matches) > 1:
+            raise ValueError(f"Pattern {text} contains multiple {flag}.")
+        for match in matches:
+            command += f" --{flag} {match}"
+
     print(command)
 
 if __name__ == "__main__":
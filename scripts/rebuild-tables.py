@@ -0,0 +1,168 @@
+"""
+Convert pending JSON datasets in datasets/ to parquet tables in tables/
+on one machine, in a single process pool.
+
+Pending files are found the same way as for the convert-json-to-parquet workflow.
+Each worker imports the OpenFF toolkit once and then labels many files.
+"""
+
+import concurrent.futures
+import importlib.util
+import os
+import pathlib
+import time
+import traceback
+
+import click
+
+
+SCRIPT_DIRECTORY = pathlib.Path(__file__).parent
+LABEL_SCRIPTS = {
+    "optimization": "label-optimization-smiles.py",
+    "torsiondrive": "label-torsiondrive-smiles.py",
+}
+
+# label script modules, loaded once per worker process
+_LABELLERS = {}
+
+
+def load_script(name: str):
+    # script names are not valid module names, so load them by path
+    path = SCRIPT_DIRECTORY / name
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_")[:-3], path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def initialize_worker():
+    # pay for the toolkit imports and registry setup once per worker
+    import openff.toolkit
+    import openff.qcsubmit.results
+
+    for dataset_type, script in LABEL_SCRIPTS.items():
+        _LABELLERS[dataset_type] = load_script(script)
+
+
+def label_file(
+    dataset_type: str,
+    input_file: str,
+    output_directory: str,
+    resume: bool = False,
+) -> tuple[float, str]:
+    """
+    Label one JSON file with the label script for its type.
+
+    Returns
+    -------
+    elapsed : float
+        The time taken, in seconds.
+    error : str
+        The traceback if labelling failed, otherwise an empty string.
+    """
+    start = time.perf_counter()
+    error = ""
+    try:
+        _LABELLERS[dataset_type].main.callback(
+            input_file=input_file,
+            output_directory=output_directory,
+            resume=resume,
+        )
+    except Exception:
+        error = traceback.format_exc()
+    return time.perf_counter() - start, error
+
+
+@click.command()
+@click.option(
+    "--datasets-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="datasets",
+)
+@click.option(
+    "--tables-directory",
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    default="tables",
+)
+@click.option(
+    "--type",
+    "dataset_types",
+    type=click.Choice(sorted(LABEL_SCRIPTS)),
+    multiple=True,
+    default=sorted(LABEL_SCRIPTS),
+)
+@click.option(
+    "--n-workers",
+    type=int,
+    default=os.cpu_count(),
+)
+@click.option(
+    "--all",
+    "rebuild_all",
+    is_flag=True,
+    default=False,
+    help="Rebuild every table, not just the ones that are missing.",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    default=False,
+    help="Continue each file from its checkpoint, if there is one.",
+)
+def main(
+    datasets_directory: str = "datasets",
+    tables_directory: str = "tables",
+    dataset_types: list[str] = None,
+    n_workers: int = None,
+    rebuild_all: bool = False,
+    resume: bool = False,
+):
+    setup = load_script("setup-parse-dataset-matrix.py")
+
+    jobs = []
+    for dataset_type in dataset_types:
+        input_directory = pathlib.Path(datasets_directory) / dataset_type
+        output_directory = pathlib.Path(tables_directory) / dataset_type
+        if rebuild_all:
+            json_files = list(input_directory.glob("*/*.json"))
+        else:
+            json_files = setup.get_new_files(input_directory, output_directory)
+        for json_file in json_files:
+            jobs.append((dataset_type, str(json_file), str(output_directory)))
+
+    # start the biggest files first so they don't hold up the end of the run
+    jobs.sort(key=lambda job: os.path.getsize(job[1]), reverse=True)
+    print(f"Labelling {len(jobs)} files with {n_workers} workers")
+
+    start = time.perf_counter()
+    timings = []
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=initialize_worker,
+    ) as executor:
+        futures = {
+            executor.submit(label_file, *job, resume=resume): job
+            for job in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            dataset_type, input_file, _ = futures[future]
+            elapsed, error = future.result()
+            timings.append((elapsed, dataset_type, input_file))
+            status = "failed" if error else "done"
+            print(f"[{len(timings)}/{len(jobs)}] {status} in {elapsed:.1f} s: {input_file}")
+            if error:
+                print(error)
+                failed.append(input_file)
+
+    print("\nTime per file:")
+    for elapsed, dataset_type, input_file in sorted(timings, reverse=True):
+        print(f"{elapsed:8.1f} s  {dataset_type:<13} {pathlib.Path(input_file).stem}")
+    print(f"Labelled {len(jobs) - len(failed)} files in {time.perf_counter() - start:.1f} s")
+
+    if failed:
+        raise ValueError(f"{len(failed)} files failed: {failed}")
+
+
+if __name__ == "__main__":
+    main()
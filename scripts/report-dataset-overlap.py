@@ -0,0 +1,281 @@
+import pathlib
+import time
+
+import click
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pcsv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DATASET_KEYS = ["type", "dataset", "specification"]
+COLUMNS = DATASET_KEYS + ["smiles", "qcarchive_id", "torsiondrive_id"]
+
+
+def encode_memberships(
+    table: pa.Table,
+) -> tuple[np.ndarray, pa.Table, np.ndarray, np.ndarray]:
+    """
+    Assign integer IDs to datasets and unique SMILES,
+    and list which molecules each dataset contains.
+
+    Returns
+    -------
+    molecule_ids : np.ndarray
+        The molecule ID of each row of ``table``.
+    datasets : pa.Table
+        The ``DATASET_KEYS`` of each dataset, indexed by dataset ID.
+    pair_datasets : np.ndarray
+        The dataset ID of each (dataset, molecule) membership.
+    pair_molecules : np.ndarray
+        The molecule ID of each (dataset, molecule) membership.
+        Memberships are unique and sorted by dataset, then molecule,
+        so the molecules of each dataset form a sorted array.
+    """
+    encoded = pc.dictionary_encode(table["smiles"]).combine_chunks()
+    molecule_ids = encoded.indices.to_numpy().astype(np.int64)
+    n_molecules = len(encoded.dictionary)
+
+    datasets = table.select(DATASET_KEYS).group_by(DATASET_KEYS).aggregate([])
+    datasets = datasets.sort_by([(key, "ascending") for key in DATASET_KEYS])
+    dataset_labels = pc.binary_join_element_wise(
+        *[datasets[key] for key in DATASET_KEYS], "/"
+    )
+    row_labels = pc.binary_join_element_wise(
+        *[table[key] for key in DATASET_KEYS], "/"
+    )
+    dataset_ids = pc.index_in(row_labels, value_set=dataset_labels).to_numpy()
+
+    pairs = np.unique(dataset_ids.astype(np.int64) * n_molecules + molecule_ids)
+    pair_datasets, pair_molecules = np.divmod(pairs, n_molecules)
+    return molecule_ids, datasets, pair_datasets, pair_molecules
+
+
+def compute_overlaps(
+    pair_datasets: np.ndarray,
+    pair_molecules: np.ndarray,
+    n_datasets: int,
+    n_molecules: int,
+) -> np.ndarray:
+    """
+    Count the molecules shared by every pair of datasets.
+
+    For each dataset, its sorted molecule array is scattered into a
+    bitmap over all molecules, and every membership is looked up in it.
+    This is linear in the number of memberships per dataset,
+    rather than quadratic in the number of molecules.
+
+    Returns
+    -------
+    np.ndarray
+        A symmetric (n_datasets, n_datasets) matrix of shared molecule counts.
+        The diagonal holds the number of molecules in each dataset.
+    """
+    boundaries = np.searchsorted(pair_datasets, np.arange(n_datasets + 1))
+    bitmap = np.zeros(n_molecules, dtype=bool)
+    overlaps = np.zeros((n_datasets, n_datasets), dtype=np.int64)
+    for i in range(n_datasets):
+        molecules = pair_molecules[boundaries[i]:boundaries[i + 1]]
+        bitmap[molecules] = True
+        overlaps[i] = np.bincount(
+            pair_datasets[bitmap[pair_molecules]],
+            minlength=n_datasets,
+        )
+        bitmap[molecules] = False
+    return overlaps
+
+
+def get_combination_molecules(
+    table: pa.Table,
+    molecule_ids: np.ndarray,
+    combination_file: pathlib.Path,
+    n_molecules: int,
+) -> np.ndarray:
+    """
+    Return a bitmap over molecules of those in a combination of QCA IDs.
+    """
+    combination = pcsv.read_csv(combination_file)
+    is_optimization = pc.equal(combination["type"], "optimization")
+    is_torsiondrive = pc.equal(combination["type"], "torsiondrive")
+    optimizations = combination.filter(is_optimization)["id"]
+    torsiondrives = combination.filter(is_torsiondrive)["id"]
+
+    in_combination = pc.or_(
+        pc.is_in(table["qcarchive_id"], value_set=optimizations.combine_chunks()),
+        pc.is_in(table["torsiondrive_id"], value_set=torsiondrives.combine_chunks()),
+    ).to_numpy(zero_copy_only=False)
+
+    bitmap = np.zeros(n_molecules, dtype=bool)
+    bitmap[molecule_ids[in_combination]] = True
+    return bitmap
+
+
+def to_markdown(table: pa.Table) -> str:
+    return table.to_pandas().to_markdown(index=False, floatfmt=".3f")
+
+
+@click.command()
+@click.option(
+    "--dataset-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="tables",
+)
+@click.option(
+    "--extra-table",
+    "extra_tables",
+    type=click.Path(exists=True, dir_okay=False, file_okay=True),
+    multiple=True,
+    default=[],
+    help=(
+        "Parquet files from the labelling scripts to include, "
+        "e.g. a dataset that is not yet submitted."
+    ),
+)
+@click.option(
+    "--combinations-directory",
+    type=click.Path(exists=True, dir_okay=True, file_okay=False),
+    default="combinations",
+)
+@click.option(
+    "--combination",
+    "combinations",
+    type=str,
+    multiple=True,
+    default=[],
+    help="Combinations to report coverage for. Defaults to all of them.",
+)
+@click.option(
+    "--output-directory",
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    default="overlap-report",
+)
+def main(
+    dataset_directory: str = "tables",
+    extra_tables: list[str] = None,
+    combinations_directory: str = "combinations",
+    combinations: list[str] = None,
+    output_directory: str = "overlap-report",
+):
+    start = time.perf_counter()
+
+    tables = [ds.dataset(dataset_directory).to_table(columns=COLUMNS)]
+    for extra_table in extra_tables:
+        tables.append(pq.read_table(extra_table, columns=COLUMNS))
+    table = pa.concat_tables(tables, promote_options="permissive")
+
+    molecule_ids, datasets, pair_datasets, pair_molecules = encode_memberships(table)
+    n_datasets = len(datasets)
+    n_molecules = int(molecule_ids.max()) + 1
+    print(f"Loaded {n_molecules} unique molecules in {n_datasets} datasets")
+
+    overlaps = compute_overlaps(pair_datasets, pair_molecules, n_datasets, n_molecules)
+    sizes = np.diag(overlaps)
+
+    # every dataset, including those sharing nothing with the others
+    n_datasets_per_molecule = np.bincount(pair_molecules, minlength=n_molecules)
+    n_shared_with_any = np.bincount(
+        pair_datasets,
+        weights=n_datasets_per_molecule[pair_molecules] > 1,
+        minlength=n_datasets,
+    ).astype(np.int64)
+    dataset_table = datasets.append_column(
+        "n_molecules", pa.array(sizes)
+    ).append_column(
+        "n_shared_with_any", pa.array(n_shared_with_any)
+    ).append_column(
+        "fraction_shared_with_any", pa.array(n_shared_with_any / sizes)
+    )
+
+    i, j = np.nonzero(overlaps)
+    other = datasets.take(j).rename_columns([f"other_{key}" for key in DATASET_KEYS])
+    overlap_table = pa.table(
+        {
+            **{key: datasets[key].take(i) for key in DATASET_KEYS},
+            **{name: other[name] for name in other.column_names},
+            "n_molecules": sizes[i],
+            "other_n_molecules": sizes[j],
+            "n_shared": overlaps[i, j],
+            "fraction_shared": overlaps[i, j] / sizes[i],
+        }
+    )
+    overlap_table = overlap_table.filter(pa.array(i != j))
+    overlap_table = overlap_table.sort_by([("n_shared", "descending"), ("dataset", "ascending")])
+
+    if not combinations:
+        combinations = sorted(
+            file.stem
+            for file in pathlib.Path(combinations_directory).glob("*.csv")
+        )
+
+    coverage_tables = []
+    combination_sizes = {}
+    for combination in combinations:
+        combination_file = pathlib.Path(combinations_directory) / f"{combination}.csv"
+        bitmap = get_combination_molecules(table, molecule_ids, combination_file, n_molecules)
+        combination_sizes[combination] = int(bitmap.sum())
+
+        n_covered = np.bincount(
+            pair_datasets,
+            weights=bitmap[pair_molecules],
+            minlength=n_datasets,
+        ).astype(np.int64)
+        coverage_tables.append(
+            datasets.append_column(
+                "combination", pa.array([combination] * n_datasets)
+            ).append_column(
+                "n_molecules", pa.array(sizes)
+            ).append_column(
+                "n_in_combination", pa.array(n_covered)
+            ).append_column(
+                "fraction_in_combination", pa.array(n_covered / sizes)
+            )
+        )
+
+    output_directory = pathlib.Path(output_directory)
+    output_directory.mkdir(exist_ok=True, parents=True)
+    pq.write_table(overlap_table, output_directory / "overlap.parquet")
+    pq.write_table(dataset_table, output_directory / "datasets.parquet")
+
+    report = (
+        "# Dataset overlap\n\n"
+        f"{n_molecules} unique molecules in {n_datasets} datasets.\n\n"
+        "## Datasets\n\n"
+        "Every dataset, with the number of its molecules found in any other dataset.\n\n"
+        + to_markdown(dataset_table)
+        + "\n\n## Shared molecules\n\n"
+        "Pairs of datasets sharing at least one molecule. "
+        "`fraction_shared` is relative to the first dataset.\n\n"
+        + to_markdown(overlap_table.select([
+            "type", "dataset", "specification",
+            "other_type", "other_dataset", "other_specification",
+            "n_molecules", "n_shared", "fraction_shared",
+        ]))
+    )
+
+    if coverage_tables:
+        coverage_table = pa.concat_tables(coverage_tables)
+        pq.write_table(coverage_table, output_directory / "coverage.parquet")
+
+        report += "\n\n## Combination coverage\n"
+        for combination in combinations:
+            rows = coverage_table.filter(pc.equal(coverage_table["combination"], combination))
+            rows = rows.sort_by([("n_in_combination", "descending")])
+            report += (
+                f"\n### {combination}\n\n"
+                f"{combination_sizes[combination]} unique molecules.\n\n"
+                + to_markdown(rows.select([
+                    "type", "dataset", "specification",
+                    "n_molecules", "n_in_combination", "fraction_in_combination",
+                ]))
+                + "\n"
+            )
+
+    report_file = output_directory / "overlap.md"
+    report_file.write_text(report)
+    print(f"Saved report to {output_directory} in {time.perf_counter() - start:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
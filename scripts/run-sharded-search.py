@@ -0,0 +1,81 @@
+"""
+Run a sharded search locally, with one process standing in
+for each runner of the search workflow's matrix.
+
+Any arguments not listed below are passed through to get-smiles-matches.py, e.g.
+
+    python scripts/run-sharded-search.py --n-shards 4 -- --pattern '[#15:1]-[#16:2]' --dry-run
+"""
+
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+
+
+SEARCH_SCRIPT = pathlib.Path(__file__).parent / "get-smiles-matches.py"
+
+
+@click.command(context_settings={"ignore_unknown_options": True})
+@click.option(
+    "--n-shards",
+    type=int,
+    default=4,
+)
+@click.option(
+    "--output-directory",
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    default="artifact",
+)
+@click.option(
+    "--shard-directory",
+    type=click.Path(exists=False, dir_okay=True, file_okay=False),
+    default=None,
+    help="Where to keep shard results. Defaults to a temporary directory.",
+)
+@click.argument("search_args", nargs=-1, type=click.UNPROCESSED)
+def main(
+    search_args: list[str],
+    n_shards: int = 4,
+    output_directory: str = "artifact",
+    shard_directory: str = None,
+):
+    base_command = [sys.executable, str(SEARCH_SCRIPT), *search_args]
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        shard_directory = pathlib.Path(shard_directory or tempdir)
+
+        start = time.perf_counter()
+        processes = [
+            subprocess.Popen(
+                base_command + [
+                    "--n-shards", str(n_shards),
+                    "--shard-index", str(shard_index),
+                    "--output-directory", str(shard_directory / f"shard-{shard_index}"),
+                ]
+            )
+            for shard_index in range(n_shards)
+        ]
+        failed = [
+            shard_index
+            for shard_index, process in enumerate(processes)
+            if process.wait() != 0
+        ]
+        if failed:
+            raise ValueError(f"Shards {failed} failed")
+        print(f"Searched {n_shards} shards in {time.perf_counter() - start:.1f} s")
+
+        subprocess.run(
+            base_command + [
+                "--merge-shards", str(shard_directory),
+                "--output-directory", output_directory,
+            ],
+            check=True,
+        )
+
+
+if __name__ == "__main__":
+    main()
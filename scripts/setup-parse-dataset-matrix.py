@@ -4,6 +4,27 @@ import pathlib
 import click
 
 
+def get_new_files(
+    input_directory: pathlib.Path,
+    output_directory: pathlib.Path,
+) -> list[pathlib.Path]:
+    """
+    Find JSON datasets in ``input_directory`` that have
+    no parquet table in ``output_directory`` yet.
+    """
+    json_files = list(input_directory.glob("*/*.json"))
+    parquet_files = list(output_directory.glob("*/*.parquet"))
+    new_files = []
+
+    for json_file in json_files:
+        dataset = json_file.stem
+        spec = json_file.parent.name
+        parquet_file = output_directory / spec / f"{dataset}.parquet"
+        if parquet_file not in parquet_files:
+            new_files.append(json_file)
+    return new_files
+
+
 @click.command()
 @click.option(
     "--input-directory",
@@ -18,23 +39,15 @@ def main(
     output_directory: str,
 ):
     input_directory = pathlib.Path(input_directory)
-    json_files = list(input_directory.glob("*/*.json"))
     output_directory = pathlib.Path(output_directory)
     output_directory.mkdir(exist_ok=True, parents=True)
-    parquet_files = list(output_directory.glob("*/*.parquet"))
-    new_files = []
-
-    for json_file in json_files:
-        dataset = json_file.stem
-        spec = json_file.parent.name
-        parquet_file = output_directory / spec / f"{dataset}.parquet"
-        if parquet_file not in parquet_files:
-            new_files.append({
-                "file": str(json_file)
-            })
+    new_files = [
+        {"file": str(json_file)}
+        for json_file in get_new_files(input_directory, output_directory)
+    ]
     
     print(json.dumps(new_files))
     
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,23 @@
+import json
+
+import click
+
+
+@click.command()
+@click.option(
+    "--n-shards",
+    type=int,
+    default=4,
+)
+def main(
+    n_shards: int,
+):
+    entries = [
+        {"shard": shard_index, "n_shards": n_shards}
+        for shard_index in range(n_shards)
+    ]
+    print(json.dumps(entries))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,54 @@
+import csv
+import pathlib
+import tarfile
+import typing
+import zipfile
+
 import click
 
-import pathlib
-import pandas as pd
+
+def iter_target_paths(targets_path: pathlib.Path) -> typing.Iterator[pathlib.PurePosixPath]:
+    """
+    List the paths in a ForceBalance targets directory or archive,
+    relative to the targets directory.
+
+    Tarballs (optionally compressed) are read as a stream,
+    and zip files from their central directory,
+    so only member names are read and nothing is extracted.
+    """
+    if targets_path.is_dir():
+        for pattern in ("torsion-*", "opt-*/*.xyz"):
+            for path in targets_path.glob(pattern):
+                yield pathlib.PurePosixPath(path.relative_to(targets_path).as_posix())
+    elif zipfile.is_zipfile(targets_path):
+        with zipfile.ZipFile(targets_path) as archive:
+            for name in archive.namelist():
+                yield pathlib.PurePosixPath(name)
+    elif tarfile.is_tarfile(targets_path):
+        with tarfile.open(targets_path, mode="r|*") as archive:
+            for member in archive:
+                yield pathlib.PurePosixPath(member.name)
+    else:
+        raise ValueError(f"{targets_path} is not a directory, tarball or zip file")
+
+
+def get_entry(path: pathlib.PurePosixPath) -> typing.Optional[tuple[str, int]]:
+    """
+    Get the QCA record type and ID of a target from one of its paths.
+
+    Torsiondrives are ``torsion-*`` directories named with the
+    torsiondrive ID last, and optimizations are ``opt-*/*.xyz`` files
+    named with the optimization ID first.
+    Archives may wrap the targets in a top-level directory,
+    so the names are matched from the end of the path.
+    """
+    parts = [part for part in path.parts if part not in ("", ".")]
+    if len(parts) >= 2 and parts[-2].startswith("opt-") and path.suffix == ".xyz":
+        return "optimization", int(path.stem.split("-")[0])
+    for part in parts[-2:]:
+        if part.startswith("torsion-"):
+            return "torsiondrive", int(part.split("-")[-1])
+    return None
 
 
 @click.command()
@@ -9,7 +56,10 @@ import pandas as pd
     "--targets-path",
     required=True,
     type=str,
-    help="Path to the directory containing the targets.",
+    help=(
+        "Path to the directory containing the targets, "
+        "or to a tarball or zip file of it."
+    ),
 )
 @click.option(
     "--output-path",
@@ -23,28 +73,23 @@ def main(
 ):
     targets_path = pathlib.Path(targets_path)
 
-    all_entries = []
-
-    torsiondrives = targets_path.glob("torsion-*")
-    for torsiondrive in torsiondrives:
-        td_id = int(torsiondrive.stem.split("-")[-1])
-        entry = {
-            "type": "torsiondrive",
-            "id": td_id,
-        }
-        all_entries.append(entry)
-    
-    optimizations = targets_path.glob("opt-*/*.xyz")
-    for optimization in optimizations:
-        opt_id = int(optimization.stem.split("-")[0])
-        entry = {
-            "type": "optimization",
-            "id": opt_id,
-        }
-        all_entries.append(entry)
-    
-    df = pd.DataFrame(all_entries)
-    df.to_csv(output_path, index=False)
+    entries = set()
+    for path in iter_target_paths(targets_path):
+        entry = get_entry(path)
+        if entry is not None:
+            entries.add(entry)
+
+    # torsiondrives first, as before, then by ID for stable diffs
+    entries = sorted(entries, key=lambda entry: (entry[0] != "torsiondrive", entry[1]))
+    with open(output_path, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["type", "id"])
+        writer.writerows(entries)
+    n_torsiondrives = sum(entry[0] == "torsiondrive" for entry in entries)
+    print(
+        f"Saved {n_torsiondrives} torsiondrives and "
+        f"{len(entries) - n_torsiondrives} optimizations to {output_path}"
+    )
 
 
 if __name__ == "__main__":